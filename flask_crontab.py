@@ -12,11 +12,10 @@ import hashlib
 import json
 import logging
 import os
-import re
 import subprocess
 import sys
 import tempfile
-from typing import Dict, Tuple, Any, Callable, List, Optional
+from typing import Dict, Tuple, Any, Callable, Iterator, List, Optional
 
 import click
 from flask import current_app, Flask
@@ -46,6 +45,11 @@ class _CronJob:
             if not given, '*' is implied.
         args: An tuple of positional arguments passed to func.
         kwargs: A dict of keyword arguments passed to func.
+
+    The job hash is computed from the ``repr`` of args and kwargs, so they may only
+    contain JSON serializable values: strings, numbers, booleans, None and lists,
+    tuples or dicts of them. Other types like sets or arbitrary objects don't have
+    a stable ``repr`` across processes and raise TypeError.
     """
 
     def __init__(
@@ -61,22 +65,32 @@ class _CronJob:
         kwargs: Dict[str, Any]
     ) -> None:
         self.func = func
-        self.schedule = "{} {} {} {} {}".format(minute, hour, day, month, day_of_week)
+        self.schedule = f"{minute} {hour} {day} {month} {day_of_week}"
         self.args = args
         self.kwargs = kwargs
-        self.func_ident = "{func.__module__}:{func.__name__}".format(func=func)
+        self.func_ident = f"{func.__module__}:{func.__name__}"
+        try:
+            json.dumps([args, kwargs])
+        except TypeError:
+            raise TypeError(
+                f"Arguments of cron job {self.func_ident} must be JSON serializable"
+            ) from None
+        self._hash = None  # type: Optional[str]
 
     @property
     def hash(self) -> str:
-        data = {
-            "name": self.func_ident,
-            "schedule": self.schedule,
-            "args": self.args,
-            "kwargs": self.kwargs,
-        }
-        j = json.JSONEncoder(sort_keys=True).encode(data)
-        h = hashlib.md5(j.encode("utf-8")).hexdigest()
-        return h
+        if self._hash is not None:
+            return self._hash
+        key = b"\0".join(
+            [
+                self.func_ident.encode("utf-8"),
+                self.schedule.encode("utf-8"),
+                repr(self.args).encode("utf-8"),
+                repr(sorted(self.kwargs.items())).encode("utf-8"),
+            ]
+        )
+        self._hash = hashlib.blake2b(key, digest_size=16).hexdigest()
+        return self._hash
 
     def run(self) -> None:
         try:
@@ -85,38 +99,30 @@ class _CronJob:
             logger.exception("Failed to complete cronjob at %s", self.func_ident)
             raise
 
-    def as_crontab_line(self) -> str:
-        flask_bin = sys.executable + " -m flask"
-        env_prefix = (
-            "FLASK_APP={} ".format(os.getenv("FLASK_APP"))
-            if os.getenv("FLASK_APP")
-            else ""
+    def as_crontab_line(self, crontab: "_Crontab") -> str:
+        return (
+            f"{self.schedule} {crontab.flask_command} crontab run {self.hash}  "
+            f"# {crontab.crontab_comment}"
         )
-        crontab_comment = "Flask cron jobs for {}".format(current_app.name)
-        line = "{} cd {} && {}{} crontab run {}  # {}".format(
-            self.schedule,
-            os.getcwd(),
-            env_prefix,
-            flask_bin,
-            self.hash,
-            crontab_comment,
-        )
-        return line
 
 
 class _Crontab:
-    CRONTAB_LINE_REGEXP = re.compile(
-        r"^\s*((?:[^#\s]+\s+){5})([^#\n]*?)\s*(?:#\s*([^\n]*)|$)"
-    )
-
     def __init__(self, *, verbose: bool = True, readonly: bool = False):
         obj = _ensure_extension_object()
         self.jobs = obj.jobs
+        self.jobs_by_hash = obj.jobs_by_hash
         self.verbose = verbose
         self.readonly = readonly
-        self.crontab_lines = []  # type: List[str]
+        self._raw = ""
+        self._lines = None  # type: Optional[List[str]]
+        self._dirty = False
         self.settings = current_app.config.get_namespace("CRONTAB_")
-        self.crontab_comment = "Flask cron jobs for {}".format(current_app.name)
+        self.crontab_comment = f"Flask cron jobs for {current_app.name}"
+        flask_app = os.getenv("FLASK_APP")
+        env_prefix = f"FLASK_APP={flask_app} " if flask_app else ""
+        self.flask_command = (
+            f"cd {os.getcwd()} && {env_prefix}{sys.executable} -m flask"
+        )
 
     def __enter__(self) -> "_Crontab":
         """
@@ -128,87 +134,123 @@ class _Crontab:
     def __exit__(self, type, value, traceback) -> None:
         """
         Automatically write back crontab when used as with statement
-        if readonly is False
+        if readonly is False and the buffer has been changed
         """
-        if not self.readonly:
+        if not self.readonly and self._dirty:
             self.write()
 
-    def __get_crontab_lines(self):
-        try:
-            return subprocess.run(
-                [self.settings["executable"], "-l"], stdout=subprocess.PIPE
-            ).stdout.decode("utf-8").splitlines()
-        except AttributeError:
-            return []
+    @property
+    def crontab_lines(self) -> List[str]:
+        """
+        The crontab lines, split from the raw buffer on first access
+        """
+        if self._lines is None:
+            self._lines = self._raw.splitlines()
+        return self._lines
+
+    @crontab_lines.setter
+    def crontab_lines(self, lines: List[str]) -> None:
+        self._lines = lines
+
+    def __get_crontab(self) -> str:
+        cp = subprocess.run(
+            [self.settings["executable"], "-l"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            encoding="utf-8",
+        )
+        # crontab exits non-zero when the user has no crontab yet
+        return cp.stdout if cp.returncode == 0 else ""
 
     def read(self) -> None:
         """
         Reads the crontab into internal buffer
         """
-        self.crontab_lines[:] = self.__get_crontab_lines()
+        self._raw = self.__get_crontab()
+        self._lines = None
+        self._dirty = False
 
     def write(self) -> None:
         """
         Writes internal buffer back to crontab
         """
-        fd, path = tempfile.mkstemp()
-        tmp = os.fdopen(fd, "w")
-        for line in self.crontab_lines:
-            tmp.write(line + "\n")
-        tmp.close()
-        # replace the contab with the temporary file
-        subprocess.run([self.settings["executable"], path], stdout=subprocess.PIPE)
-        os.unlink(path)
+        payload = "".join(line + "\n" for line in self.crontab_lines)
+        # replace the crontab with the buffer piped through stdin
+        subprocess.run(
+            [self.settings["executable"], "-"],
+            input=payload,
+            encoding="utf-8",
+            stdout=subprocess.PIPE,
+        )
 
     def add_jobs(self) -> None:
         """
         Adds all jobs defined in CRONJOBS setting to internal buffer
         """
-        for job in self.jobs:
-            print("Adding cronjob: {} -> {}".format(job.hash, job.func_ident))
-            self.crontab_lines.append(job.as_crontab_line())
+        messages = []  # type: List[str]
+        self.__append_jobs(self.crontab_lines, messages)
+        sys.stdout.write("".join(messages))
+        if self.jobs:
+            self._dirty = True
 
     def show_jobs(self) -> None:
         """
         Print the jobs from from crontab
         """
-        print("Currently active jobs in crontab:")
-        for line in self.crontab_lines:
-            # check if the line describes a crontab job
-            job = self.CRONTAB_LINE_REGEXP.match(line)
-            if not job:
-                continue
-            # if the job is generated using django_crontab for this application
-            sched, script, comment = job.groups()
-            if comment == self.crontab_comment:
-                job_hash = script.split("crontab run ")[1]
-                print(
-                    "{} -> {}".format(
-                        job_hash, self.__get_job_by_hash(job_hash).func_ident
-                    )
-                )
+        messages = ["Currently active jobs in crontab:\n"]
+        for _, job_hash in self.__iter_app_jobs():
+            job = self.__get_job_by_hash(job_hash)
+            messages.append(f"{job_hash} -> {job.func_ident}\n")
+        sys.stdout.write("".join(messages))
 
     def remove_jobs(self) -> None:
         """
         Removes all jobs defined in CRONJOBS setting from internal buffer
         """
-        for line in self.crontab_lines[:]:
-            # check if the line describes a crontab job
-            job = self.CRONTAB_LINE_REGEXP.match(line)
-            if not job:
-                continue
-            # if the job is generated using django_crontab for this application
-            sched, script, comment = job.groups()
-            if comment == self.crontab_comment:
-                self.crontab_lines.remove(line)
-                # output the action if the verbose option is specified
-                job_hash = script.split("crontab run ")[1]
-                if self.verbose:
-                    print(
-                        "Removing cronjob: {} -> {}".format(
-                            job_hash, self.__get_job_by_hash(job_hash).func_ident
-                        )
-                    )
+        messages = []  # type: List[str]
+        kept_lines = self.__drop_app_jobs(messages)
+        sys.stdout.write("".join(messages))
+        if len(kept_lines) != len(self.crontab_lines):
+            self._dirty = True
+            self.crontab_lines[:] = kept_lines
+
+    def refresh_jobs(self) -> None:
+        """
+        Replaces the jobs of this application in internal buffer with the ones
+        currently defined, in a single pass over the crontab lines
+        """
+        messages = []  # type: List[str]
+        lines = self.__drop_app_jobs(messages)
+        self.__append_jobs(lines, messages)
+        sys.stdout.write("".join(messages))
+        if lines != self.crontab_lines:
+            self._dirty = True
+            self.crontab_lines[:] = lines
+
+    def __append_jobs(self, lines: List[str], messages: List[str]) -> None:
+        """
+        Appends a crontab line to ``lines`` and a message to ``messages`` for
+        each job of this app
+        """
+        for job in self.jobs:
+            messages.append(f"Adding cronjob: {job.hash} -> {job.func_ident}\n")
+            lines.append(job.as_crontab_line(self))
+
+    def __drop_app_jobs(self, messages: List[str]) -> List[str]:
+        """
+        Returns the crontab lines not managed by this app, appending a message
+        to ``messages`` for each dropped job if verbose
+        """
+        to_drop = set()
+        for index, job_hash in self.__iter_app_jobs():
+            to_drop.add(index)
+            # output the action if the verbose option is specified
+            if self.verbose:
+                # stale hashes are dropped too, so that the crontab can be re-synced
+                job = self.jobs_by_hash.get(job_hash)
+                func_ident = job.func_ident if job else "<unknown>"
+                messages.append(f"Removing cronjob: {job_hash} -> {func_ident}\n")
+        return [line for i, line in enumerate(self.crontab_lines) if i not in to_drop]
 
     # noinspection PyBroadException
     def run_job(self, job_hash: str) -> None:
@@ -217,49 +259,65 @@ class _Crontab:
         """
         job = self.__get_job_by_hash(job_hash)
 
-        lock_file_name = None
+        lock_enabled = self.settings["lock_jobs"]
         # if the LOCK_JOBS option is specified in settings
-        if self.settings["lock_jobs"]:
-            # create and open a lock file
-            lock_file = open(
-                os.path.join(
-                    tempfile.gettempdir(), "flask_crontab_%s.lock" % job_hash
-                ),
-                "w",
+        if lock_enabled:
+            # create or open the lock file without truncating it
+            lock_path = os.path.join(
+                tempfile.gettempdir(), f"flask_crontab_{job_hash}.lock"
+            )
+            lock_fd = os.open(
+                lock_path, os.O_WRONLY | os.O_CREAT | os.O_CLOEXEC, 0o600
             )
-            lock_file_name = lock_file.name
             try:
                 # acquire the lock
-                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
-            except IOError:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(lock_fd)
                 logger.warning(
                     "Tried to start cron job %s that is already running.", job
                 )
                 return
-        # run the function
-        job.run()
-
-        # if the LOCK_JOBS option is specified in settings
-        if self.settings["lock_jobs"]:
-            try:
-                # release the lock
-                fcntl.flock(lock_file, fcntl.LOCK_UN)
-            except IOError:
-                logger.exception("Error unlocking %s", lock_file_name)
-                return
+        try:
+            # run the function
+            job.run()
+        finally:
+            if lock_enabled:
+                try:
+                    # release the lock
+                    fcntl.flock(lock_fd, fcntl.LOCK_UN)
+                except OSError:
+                    logger.exception("Error unlocking %s", lock_path)
+                finally:
+                    os.close(lock_fd)
+
+    def __iter_app_jobs(self) -> Iterator[Tuple[int, str]]:
+        """
+        Yields the index and job hash of every crontab line managed by this app
+        """
+        for index, line in enumerate(self.crontab_lines):
+            head, _, comment = line.partition("#")
+            # if the job is generated using flask_crontab for this application
+            if comment.strip() != self.crontab_comment:
+                continue
+            # check if the line describes a crontab job: 5 schedule fields + script
+            fields = head.split(None, 5)
+            if len(fields) < 6:
+                continue
+            yield index, fields[5].rpartition("crontab run ")[2].strip()
 
     def __get_job_by_hash(self, job_hash):
         """
         Finds the job by given hash
         """
-        for job in self.jobs:
-            if job.hash == job_hash:
-                return job
-        raise RuntimeError(
-            "No job with hash %s found. It seems the crontab is out of sync with your "
-            'application. Run "flask crontab add" again to resolve this issue!'
-            % job_hash
-        )
+        try:
+            return self.jobs_by_hash[job_hash]
+        except KeyError:
+            raise RuntimeError(
+                "No job with hash %s found. It seems the crontab is out of sync with "
+                'your application. Run "flask crontab add" again to resolve this issue!'
+                % job_hash
+            )
 
 
 def common_options(f):
@@ -282,8 +340,7 @@ def crontab_cli():
 @common_options
 def add(verbose):
     with _Crontab(verbose=verbose) as c:
-        c.remove_jobs()
-        c.add_jobs()
+        c.refresh_jobs()
 
 
 @crontab_cli.command()
@@ -312,6 +369,7 @@ class Crontab:
     def __init__(self, app: Optional[Flask] = None) -> None:
         self.app = app
         self.jobs = []  # type: List[_CronJob]
+        self.jobs_by_hash = {}  # type: Dict[str, _CronJob]
         if app is not None:
             self.init_app(app)
 
@@ -347,6 +405,7 @@ class Crontab:
                 kwargs=kwargs or {},
             )
             self.jobs.append(job)
+            self.jobs_by_hash.setdefault(job.hash, job)
             return func
 
         return wrapper
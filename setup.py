@@ -62,13 +62,12 @@ setup(
     py_modules=["flask_crontab"],
     license="MIT",
     install_requires=["flask"],
-    python_requires=">=3.5",
+    python_requires=">=3.6",
     entry_points={"flask.commands": ["crontab=flask_crontab:crontab_cli"]},
     cmdclass={"publish": UploadCommand},
     classifiers=[
         "License :: OSI Approved :: MIT License",
         "Programming Language :: Python",
-        "Programming Language :: Python :: 3.5",
         "Programming Language :: Python :: 3.6",
         "Programming Language :: Python :: 3.7",
         "Programming Language :: Python :: 3.8",
@@ -1,6 +1,7 @@
 import pytest
 from unittest import mock
 from functools import partial
+import tempfile
 
 from flask import Flask, current_app
 import flask_crontab
@@ -24,6 +25,7 @@ def _crontab(crontab, monkeypatch, source):
 
     def read(self):
         self.crontab_lines[:] = source
+        self._dirty = False
 
     with crontab.app.app_context():
         flask_crontab._Crontab.read = read
@@ -47,12 +49,29 @@ def test_add_jobs(crontab, _crontab, invoke):
     result = invoke(args=["add"])
     assert result.exit_code == 0
     assert (
-        "Adding cronjob: 98fa712b876a5ec6f63cff664b748da3 -> test_flask_crontab:foo"
+        "Adding cronjob: dfc56f47ae54dea0db9d11402260600a -> test_flask_crontab:foo"
         in result.output
     )
     assert "* * * * *" in _crontab.crontab_lines[0]
 
 
+def test_add_replaces_md5_jobs(crontab, _crontab, invoke, source):
+    # a line written by a version that hashed jobs with MD5
+    source[:] = [
+        "* * * * * cd /app && flask crontab run 98fa712b876a5ec6f63cff664b748da3  "
+        "# Flask cron jobs for test_flask_crontab"
+    ]
+
+    @crontab.job()
+    def foo():
+        pass
+
+    result = invoke(args=["add"])
+    assert result.exit_code == 0
+    assert len(source) == 1
+    assert "crontab run dfc56f47ae54dea0db9d11402260600a" in source[0]
+
+
 def test_remove_jobs(crontab, _crontab, invoke, source):
     source[:] = ["* * * * * echo hello", "*/5 * * * mon-fri echo foobar"]
 
@@ -65,12 +84,70 @@ def test_remove_jobs(crontab, _crontab, invoke, source):
     result = invoke(args=["remove"])
     assert result.exit_code == 0
     assert (
-        "Removing cronjob: 98fa712b876a5ec6f63cff664b748da3 -> test_flask_crontab:foo"
+        "Removing cronjob: dfc56f47ae54dea0db9d11402260600a -> test_flask_crontab:foo"
         in result.output
     )
     assert len(_crontab.crontab_lines) == 2
 
 
+def test_remove_unknown_jobs(crontab, _crontab, invoke, source):
+    source[:] = [
+        "* * * * * echo hello",
+        "* * * * * cd /app && flask crontab run deadbeefdeadbeefdeadbeefdeadbeef  "
+        "# Flask cron jobs for test_flask_crontab",
+    ]
+
+    result = invoke(args=["remove"])
+    assert result.exit_code == 0
+    assert (
+        "Removing cronjob: deadbeefdeadbeefdeadbeefdeadbeef -> <unknown>"
+        in result.output
+    )
+    assert source == ["* * * * * echo hello"]
+
+
+def test_remove_duplicate_jobs(crontab, _crontab, invoke, source):
+    source[:] = ["* * * * * echo hello"]
+
+    @crontab.job()
+    def foo():
+        pass
+
+    invoke(args=["add"])
+    source.append(source[-1])
+    source.append("* * * * * echo hello")
+    result = invoke(args=["remove"])
+    assert result.exit_code == 0
+    assert source == ["* * * * * echo hello", "* * * * * echo hello"]
+
+
+def test_remove_nothing_skips_write(crontab, _crontab, invoke, source, monkeypatch):
+    source[:] = ["* * * * * echo hello"]
+    write = mock.Mock()
+    monkeypatch.setattr(_crontab, "write", write)
+
+    result = invoke(args=["remove"])
+    assert result.exit_code == 0
+    write.assert_not_called()
+
+
+def test_add_unchanged_skips_write(crontab, _crontab, invoke, monkeypatch):
+    @crontab.job()
+    def foo():
+        pass
+
+    invoke(args=["add"])
+    write = mock.Mock()
+    monkeypatch.setattr(_crontab, "write", write)
+
+    result = invoke(args=["add"])
+    assert result.exit_code == 0
+    assert "Removing cronjob: dfc56f47ae54dea0db9d11402260600a" in result.output
+    assert "Adding cronjob: dfc56f47ae54dea0db9d11402260600a" in result.output
+    assert len(_crontab.crontab_lines) == 1
+    write.assert_not_called()
+
+
 def test_show_jobs(crontab, _crontab, invoke):
     @crontab.job()
     def foo():
@@ -83,8 +160,8 @@ def test_show_jobs(crontab, _crontab, invoke):
     invoke(args=["add"])
     result = invoke(args=["show"])
     assert result.exit_code == 0
-    assert "98fa712b876a5ec6f63cff664b748da3 -> test_flask_crontab:foo" in result.output
-    assert "f27593c4417a660d5bcaf0d498179e67 -> test_flask_crontab:bar" in result.output
+    assert "dfc56f47ae54dea0db9d11402260600a -> test_flask_crontab:foo" in result.output
+    assert "c72924e39e0173e808c33e2a9eedc01a -> test_flask_crontab:bar" in result.output
 
 
 def test_run_jobs(crontab, _crontab, invoke):
@@ -96,19 +173,42 @@ def test_run_jobs(crontab, _crontab, invoke):
     crontab.job(args=("hello",), kwargs={"name": "John"})(foo)
 
     invoke(args=["add"])
-    result = invoke(args=["run", "98fa712b876a5ec6f63cff664b748da3"])
+    result = invoke(args=["run", "dfc56f47ae54dea0db9d11402260600a"])
     assert result.exit_code == 0
     foo.assert_called_with()
-    result = invoke(args=["run", "625b3192eb860a8a0bb0a43656cedf98"])
+    result = invoke(args=["run", "6bf394f78e0746cd576af2c26ac574fb"])
     assert result.exit_code == 0
     foo.assert_called_with("hello", name="John")
 
 
+def test_run_releases_lock_on_error(crontab, _crontab, invoke, monkeypatch, tmp_path):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    foo = mock.Mock(side_effect=[ValueError, None])
+    foo.__name__ = "foo"
+    foo.__module__ = __name__
+    crontab.job()(foo)
+    _crontab.settings["lock_jobs"] = True
+
+    result = invoke(args=["run", "dfc56f47ae54dea0db9d11402260600a"])
+    assert isinstance(result.exception, ValueError)
+    result = invoke(args=["run", "dfc56f47ae54dea0db9d11402260600a"])
+    assert result.exit_code == 0
+    assert foo.call_count == 2
+
+
+@pytest.mark.parametrize("args", [({1, 2},), (object(),)])
+def test_job_rejects_unstable_args(crontab, args):
+    with pytest.raises(TypeError):
+        crontab.job(args=args)(lambda: None)
+    with pytest.raises(TypeError):
+        crontab.job(kwargs={"value": args[0]})(lambda: None)
+
+
 def test_run_with_appcontext(crontab, _crontab, invoke):
     @crontab.job()
     def check_config():
         assert current_app.config["CRONTAB_EXECUTABLE"] == "/usr/bin/crontab"
         assert not current_app.config["CRONTAB_LOCK_JOBS"]
 
-    result = invoke(args=["run", "c1ad6548c98a4fda072c8b7bab20b189"])
+    result = invoke(args=["run", "ed92265eebf67d95907b0c705fa8cf18"])
     assert result.exit_code == 0